@@ -1,6 +1,9 @@
 import streamlit as st
 import pandas as pd
 import sqlite3
+import re
+import os
+import tempfile
 import datetime
 import calendar
 from datetime import date, timedelta
@@ -8,6 +11,8 @@ from dateutil.relativedelta import relativedelta
 import plotly.graph_objects as go
 import plotly.express as px
 import numpy as np
+try: import pyarrow as pa, pyarrow.feather as feather
+except ImportError: pa = feather = None
 
 # --- 1. KONFIGURATION & CSS ---
 st.set_page_config(page_title="Cash Stuffing", layout="wide", page_icon="💶", initial_sidebar_state="collapsed")
@@ -49,7 +54,14 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
-DB_FILE = "/data/budget.db"
+DB_FILE = os.environ.get("BUDGET_DB", "/data/budget.db")
+SNAPSHOT_FILE = os.path.join(os.path.dirname(DB_FILE), "transactions.arrow")
+DATE_FMT = "%Y-%m-%d"  # kanonisches Speicherformat aller Datumsspalten
+MONTH_FMT = "%Y-%m"
+DATE_INPUT_FORMATS = ["%Y-%m-%d", "%d.%m.%Y"]  # zusätzlich zu ISO (mit/ohne Uhrzeit); strptime nimmt auch '2024-1-5'
+SNAPSHOT_FORMAT = "2"  # erhöhen, sobald sich prepare_transactions (abgeleitete Spalten) ändert
+SNAPSHOT_MAX_DELTA = 1000  # ab so vielen Delta-Zeilen (bzw. 5%) wird der Snapshot neu geschrieben
+SEARCH_RANK_MAX_HITS = 1000  # darüber wird nicht nach Relevanz sortiert (bm25 über alle Treffer), sondern neueste zuerst
 
 DE_MONTHS = {1: "Januar", 2: "Februar", 3: "März", 4: "April", 5: "Mai", 6: "Juni", 7: "Juli", 8: "August", 9: "September", 10: "Oktober", 11: "November", 12: "Dezember"}
 DEFAULT_CATEGORIES = ["Lebensmittel", "Miete", "Sparen", "Freizeit", "Transport", "Sonstiges", "Fixkosten", "Kleidung", "Geschenke", "Notgroschen"]
@@ -57,11 +69,40 @@ DEFAULT_CATEGORIES = ["Lebensmittel", "Miete", "Sparen", "Freizeit", "Transport"
 FIXED_COST_GROUPS = ["Wohnkosten", "Versicherungen", "Abos/Software", "Telefon/Handy", "Mobilität", "Unterhalt", "Kredite", "Sonstiges"]
 PRIO_OPTIONS = ["A - Hoch", "B - Mittel", "C - Niedrig", "Standard"]
 CYCLE_OPTIONS = ["Monatlich", "Vierteljährlich", "Halbjährlich", "Jährlich"]
+VERTEILER_NOTES = [50, 20, 10, 5]
+ALL_NOTES = [200, 100, 50, 20, 10, 5]
 
 # --- 2. HELPER ---
 def format_euro(val):
     return "{:,.2f} €".format(val).replace(",", "X").replace(".", ",").replace("X", ".")
 
+def to_db_date(val):
+    # Einziger Schreibpfad für Datumswerte: ISO 'YYYY-MM-DD' oder NULL
+    if val is None or val == "": return None
+    if isinstance(val, (datetime.date, datetime.datetime, pd.Timestamp)):
+        return None if pd.isnull(val) else val.strftime(DATE_FMT)
+    s = str(val).strip()
+    try: return datetime.datetime.fromisoformat(s).strftime(DATE_FMT)
+    except ValueError: pass
+    for fmt in DATE_INPUT_FORMATS:
+        try: return datetime.datetime.strptime(s, fmt).strftime(DATE_FMT)
+        except ValueError: pass
+    return None
+
+def to_db_month(val):
+    if isinstance(val, str):
+        try: return datetime.datetime.strptime(val.strip(), MONTH_FMT).strftime(MONTH_FMT)
+        except ValueError: pass
+    d = to_db_date(val)
+    return d[:7] if d else None
+
+def parse_db_dates(col):
+    return pd.to_datetime(col, format=DATE_FMT, errors='coerce')
+
+# Ungültige Datumswerte entstehen nur aus Altbeständen (alle Schreibpfade laufen über to_db_date) -> Zähler
+# bei Migration und Rohdaten-Änderungen neu setzen statt bei jedem Rerun die ganze Tabelle zu prüfen
+BAD_DATES_SQL = "INSERT OR REPLACE INTO sync_state (key, value) VALUES ('bad_dates', (SELECT count(*) FROM transactions WHERE date(date) IS NOT date))"
+
 def get_db_connection():
     return sqlite3.connect(DB_FILE)
 
@@ -95,6 +136,73 @@ def init_db():
     try: c.execute("SELECT is_cashless FROM categories LIMIT 1")
     except: c.execute("ALTER TABLE categories ADD COLUMN is_cashless INTEGER DEFAULT 0")
 
+    # Volltextsuche (FTS5, per Trigger synchron zu transactions)
+    try:
+        c.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='transactions_fts'")
+        fts_sql = c.fetchone()
+        # Jedes Suchwort ist eine Präfix-Anfrage -> Präfix-Indizes für kurze Eingaben; ältere Tabellen ohne neu anlegen
+        if fts_sql and "prefix" not in fts_sql[0]: c.execute("DROP TABLE transactions_fts")
+        fts_new = fts_sql is None or "prefix" not in fts_sql[0]
+        c.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS transactions_fts USING fts5(description, category, content='transactions', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='1 2 3')''')
+        c.execute('''CREATE TRIGGER IF NOT EXISTS transactions_fts_ai AFTER INSERT ON transactions BEGIN
+            INSERT INTO transactions_fts(rowid, description, category) VALUES (new.id, new.description, new.category); END''')
+        c.execute('''CREATE TRIGGER IF NOT EXISTS transactions_fts_ad AFTER DELETE ON transactions BEGIN
+            INSERT INTO transactions_fts(transactions_fts, rowid, description, category) VALUES ('delete', old.id, old.description, old.category); END''')
+        c.execute('''CREATE TRIGGER IF NOT EXISTS transactions_fts_au AFTER UPDATE OF description, category ON transactions BEGIN
+            INSERT INTO transactions_fts(transactions_fts, rowid, description, category) VALUES ('delete', old.id, old.description, old.category);
+            INSERT INTO transactions_fts(rowid, description, category) VALUES (new.id, new.description, new.category); END''')
+        if fts_new: c.execute("INSERT INTO transactions_fts(transactions_fts) VALUES ('rebuild')")
+    except: pass
+
+    # Änderungsprotokoll + Epoche für den Arrow-Snapshot (Inserts erkennt man an id > max_id)
+    c.execute('''CREATE TABLE IF NOT EXISTS sync_state (key TEXT PRIMARY KEY, value TEXT)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS tx_changes (seq INTEGER PRIMARY KEY AUTOINCREMENT, id INTEGER)''')
+    c.execute("CREATE TRIGGER IF NOT EXISTS tx_changes_au AFTER UPDATE ON transactions BEGIN INSERT INTO tx_changes (id) VALUES (old.id); END")
+    c.execute("CREATE TRIGGER IF NOT EXISTS tx_changes_ad AFTER DELETE ON transactions BEGIN INSERT INTO tx_changes (id) VALUES (old.id); END")
+    c.execute("INSERT OR IGNORE INTO sync_state (key, value) VALUES ('epoch', lower(hex(randomblob(8))))")
+
+    # Datumsspalten auf ISO normalisieren (einmalig, nur nicht-kanonische Werte)
+    c.execute("SELECT value FROM sync_state WHERE key='date_format'")
+    if c.fetchone() is None:
+        date_cols = [("transactions", "id", "date", to_db_date, "date(date)"), ("transactions", "id", "budget_month", to_db_month, "strftime('%Y-%m', budget_month || '-01')"),
+                     ("loans", "id", "start_date", to_db_date, "date(start_date)"), ("subscriptions", "id", "start_date", to_db_date, "date(start_date)"), ("categories", "name", "due_date", to_db_date, "date(due_date)")]
+        for table, key, col, conv, canon in date_cols:
+            rows = c.execute(f"SELECT {key}, {col} FROM {table} WHERE {col} IS NOT NULL AND {canon} IS NOT {col}").fetchall()
+            conv_map = {v: conv(v) for v in set(v for _, v in rows)}
+            upd = [(conv_map[v], k) for k, v in rows if conv_map[v] is not None or str(v).strip() == ""]
+            if not upd: continue
+            if table == "transactions" and col == "date":
+                # Saldo-Index wird unten komplett neu aufgebaut statt pro Zeile verschoben
+                for trg in ["balance_ai", "balance_ad", "balance_au_old", "balance_au_new"]: c.execute(f"DROP TRIGGER IF EXISTS {trg}")
+                c.execute("DROP TABLE IF EXISTS balance_index")
+            c.executemany(f"UPDATE {table} SET {col}=? WHERE {key}=?", upd)
+        c.execute("INSERT INTO sync_state (key, value) VALUES ('date_format', 'iso')")
+        c.execute("DELETE FROM sync_state WHERE key='bad_dates'")
+    c.execute("SELECT value FROM sync_state WHERE key='bad_dates'")
+    if c.fetchone() is None: c.execute(BAD_DATES_SQL)
+
+    # Saldo-Index: kumulierter Umschlag-Stand (SOLL - IST) je Kategorie und Tag, per Trigger gepflegt
+    c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='balance_index'")
+    bal_new = c.fetchone() is None
+    c.execute('''CREATE TABLE IF NOT EXISTS balance_index (category TEXT NOT NULL, day TEXT NOT NULL, delta REAL DEFAULT 0.0, balance REAL DEFAULT 0.0, PRIMARY KEY (category, day))''')
+    bal_add = '''INSERT OR IGNORE INTO balance_index (category, day, delta, balance)
+            VALUES (new.category, date(new.date), 0.0, COALESCE((SELECT balance FROM balance_index WHERE category = new.category AND day < date(new.date) ORDER BY day DESC LIMIT 1), 0.0));
+        UPDATE balance_index SET delta = delta + (CASE new.type WHEN 'SOLL' THEN 1 ELSE -1 END) * COALESCE(new.amount, 0) WHERE category = new.category AND day = date(new.date);
+        UPDATE balance_index SET balance = balance + (CASE new.type WHEN 'SOLL' THEN 1 ELSE -1 END) * COALESCE(new.amount, 0) WHERE category = new.category AND day >= date(new.date);'''
+    bal_del = '''UPDATE balance_index SET delta = delta - (CASE old.type WHEN 'SOLL' THEN 1 ELSE -1 END) * COALESCE(old.amount, 0) WHERE category = old.category AND day = date(old.date);
+        UPDATE balance_index SET balance = balance - (CASE old.type WHEN 'SOLL' THEN 1 ELSE -1 END) * COALESCE(old.amount, 0) WHERE category = old.category AND day >= date(old.date);'''
+    bal_new_ok = "new.type IN ('SOLL','IST') AND new.category IS NOT NULL AND date(new.date) IS NOT NULL"
+    bal_old_ok = "old.type IN ('SOLL','IST') AND old.category IS NOT NULL AND date(old.date) IS NOT NULL"
+    c.execute(f"CREATE TRIGGER IF NOT EXISTS balance_ai AFTER INSERT ON transactions WHEN {bal_new_ok} BEGIN {bal_add} END")
+    c.execute(f"CREATE TRIGGER IF NOT EXISTS balance_ad AFTER DELETE ON transactions WHEN {bal_old_ok} BEGIN {bal_del} END")
+    c.execute(f"CREATE TRIGGER IF NOT EXISTS balance_au_old AFTER UPDATE OF date, category, amount, type ON transactions WHEN {bal_old_ok} BEGIN {bal_del} END")
+    c.execute(f"CREATE TRIGGER IF NOT EXISTS balance_au_new AFTER UPDATE OF date, category, amount, type ON transactions WHEN {bal_new_ok} BEGIN {bal_add} END")
+    if bal_new:
+        c.execute('''INSERT INTO balance_index (category, day, delta, balance)
+                     SELECT category, day, delta, SUM(delta) OVER (PARTITION BY category ORDER BY day) FROM (
+                        SELECT category, date(date) AS day, SUM(CASE type WHEN 'SOLL' THEN 1 ELSE -1 END * COALESCE(amount, 0)) AS delta
+                        FROM transactions WHERE type IN ('SOLL','IST') AND category IS NOT NULL AND date(date) IS NOT NULL GROUP BY 1, 2)''')
+
     c.execute("SELECT count(*) FROM categories")
     if c.fetchone()[0] == 0:
         for cat in DEFAULT_CATEGORIES:
@@ -117,13 +225,45 @@ def add_category_to_db(new_cat, prio, is_fixed=0, is_cashless=0):
 def delete_category_from_db(cat_to_del):
     return execute_db("DELETE FROM categories WHERE name = ?", (cat_to_del,))
 
-def load_main_data():
-    df = get_data("SELECT * FROM transactions")
+def build_fts_query(term):
+    # Jedes Wort als Präfix-Suche, Sonderzeichen der FTS-Syntax werden verworfen
+    tokens = re.findall(r"\w+", term or "")
+    return " ".join(f'"{t}"*' for t in tokens)
+
+def count_search_hits(term):
+    q = build_fts_query(term)
+    if not q: return 0
+    res = get_data("SELECT count(*) AS n FROM transactions_fts WHERE transactions_fts MATCH ?", (q,))
+    return int(res['n'].iloc[0]) if not res.empty else 0
+
+def search_transactions(term, limit=25, offset=0, ranked=True):
+    # ranked=False für breite Begriffe: Rowid-Reihenfolge kommt direkt aus dem Index, ohne alle Treffer zu bewerten
+    q = build_fts_query(term)
+    if not q: return pd.DataFrame()
+    order = "f.rank" if ranked else "f.rowid DESC"
+    return get_data(f"""SELECT t.id, t.date, t.category, t.description, t.amount, t.type, t.is_online
+                        FROM transactions_fts f JOIN transactions t ON t.id = f.rowid
+                        WHERE transactions_fts MATCH ? ORDER BY {order} LIMIT ? OFFSET ?""", (q, limit, offset))
+
+def get_balances_asof(day):
+    # Je Kategorie ein Sprung in den Primärschlüssel (category, day): letzter Eintrag <= day
+    return get_data("""SELECT category, balance FROM (
+                         SELECT name AS category, (SELECT balance FROM balance_index WHERE category = c.name AND day <= ? ORDER BY day DESC LIMIT 1) AS balance
+                         FROM categories c) WHERE balance IS NOT NULL ORDER BY category""", (to_db_date(day),))
+
+def get_balance_history(categories):
+    if not categories: return pd.DataFrame()
+    ph = ",".join("?" * len(categories))
+    df = get_data(f"SELECT category, day, balance FROM balance_index WHERE category IN ({ph}) ORDER BY category, day", tuple(categories))
+    if not df.empty: df['day'] = parse_db_dates(df['day'])
+    return df
+
+def prepare_transactions(df):
     if not df.empty:
-        df['date'] = pd.to_datetime(df['date'], errors='coerce')
+        df['date'] = parse_db_dates(df['date'])
         df = df.dropna(subset=['date'])
         
-        df['budget_month'] = df['budget_month'].fillna(df['date'].dt.strftime('%Y-%m'))
+        df['budget_month'] = df['budget_month'].fillna(df['date'].dt.strftime(MONTH_FMT))
         df['is_online'] = df['is_online'].fillna(0).astype(int)
         
         df['Analyse_Monat'] = df.apply(lambda r: f"{DE_MONTHS[int(r['budget_month'].split('-')[1])]} {r['budget_month'].split('-')[0]}" if r['type']=='SOLL' and '-' in str(r['budget_month']) else f"{DE_MONTHS[r['date'].month]} {r['date'].year}", axis=1)
@@ -132,6 +272,229 @@ def load_main_data():
         df['Quartal'] = "Q" + df['date'].dt.quarter.astype(str) + " " + df['Jahr'].astype(str)
     return df
 
+def read_snapshot():
+    # Arrow/Feather unkomprimiert -> per Memory-Map ohne Kopie lesbar
+    try:
+        tbl = feather.read_table(SNAPSHOT_FILE, memory_map=True)
+        meta = {k.decode(): v.decode() for k, v in (tbl.schema.metadata or {}).items() if k.startswith(b"cs_")}
+        return tbl.to_pandas(), meta
+    except Exception:
+        return None, {}
+
+def write_snapshot(df, epoch, max_id, seq):
+    # Eigene Temp-Datei pro Schreibvorgang: Sessions laufen als Threads und dürfen sich nicht gegenseitig überschreiben
+    tmp = None
+    try:
+        tbl = pa.Table.from_pandas(df, preserve_index=False)
+        meta = dict(tbl.schema.metadata or {})
+        meta.update({b"cs_format": SNAPSHOT_FORMAT.encode(), b"cs_epoch": str(epoch).encode(), b"cs_max_id": str(max_id).encode(), b"cs_seq": str(seq).encode()})
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(SNAPSHOT_FILE), prefix=".transactions.", suffix=".tmp")
+        with os.fdopen(fd, "wb") as f: feather.write_feather(tbl.replace_schema_metadata(meta), f, compression="uncompressed")
+        os.replace(tmp, SNAPSHOT_FILE)
+        return True
+    except Exception:
+        if tmp and os.path.exists(tmp): os.remove(tmp)
+        return False
+
+def load_main_data():
+    if feather is None: return prepare_transactions(get_data("SELECT * FROM transactions"))
+    state = get_data("SELECT (SELECT value FROM sync_state WHERE key='epoch') AS epoch, (SELECT COALESCE(max(id), 0) FROM transactions) AS max_id, (SELECT COALESCE(max(seq), 0) FROM tx_changes) AS seq")
+    if state.empty or pd.isnull(state['epoch'].iloc[0]): return prepare_transactions(get_data("SELECT * FROM transactions"))
+    epoch, max_id, seq = state['epoch'].iloc[0], int(state['max_id'].iloc[0]), int(state['seq'].iloc[0])
+
+    snap, meta = read_snapshot()
+    # Anderes Format = mit altem prepare_transactions erzeugt -> wie andere Epoche komplett neu aufbauen
+    if snap is not None and meta.get("cs_format") == SNAPSHOT_FORMAT and meta.get("cs_epoch") == epoch:
+        snap_max_id, snap_seq = int(meta["cs_max_id"]), int(meta["cs_seq"])
+        if snap_max_id == max_id and snap_seq == seq: return snap
+        # Nur neue bzw. seit dem Snapshot geänderte/gelöschte Zeilen aus SQLite nachladen
+        changed = get_data("SELECT DISTINCT id FROM tx_changes WHERE seq > ?", (snap_seq,))
+        delta = get_data("SELECT * FROM transactions WHERE id > ? OR id IN (SELECT id FROM tx_changes WHERE seq > ?)", (snap_max_id, snap_seq))
+        stale = set(changed['id']) if not changed.empty else set()
+        if not delta.empty: stale |= set(delta['id'])
+        base = snap[~snap['id'].isin(stale)] if stale and 'id' in snap else snap
+        delta = prepare_transactions(delta)
+        if base.empty: df = delta.reset_index(drop=True)
+        elif delta.empty: df = base.reset_index(drop=True)
+        else: df = pd.concat([base, delta], ignore_index=True)
+        if len(stale) <= max(SNAPSHOT_MAX_DELTA, len(base) // 20): return df
+        prune_seq = snap_seq
+    else:
+        df = prepare_transactions(get_data("SELECT * FROM transactions"))
+        prune_seq = 0
+
+    # Protokoll erst bis zum vorherigen Snapshot kürzen, damit parallele Sessions nichts verpassen
+    if write_snapshot(df, epoch, max_id, seq) and prune_seq > 0:
+        execute_db("DELETE FROM tx_changes WHERE seq <= ?", (prune_seq,))
+    return df
+
+def get_data_version():
+    # Ändert sich mit jedem Schreibzugriff auf transactions (sqlite_sequence bleibt auch nach dem Kürzen von tx_changes monoton)
+    v = get_data("""SELECT (SELECT value FROM sync_state WHERE key='epoch') AS epoch, (SELECT COALESCE(max(id), 0) FROM transactions) AS max_id,
+                           (SELECT COALESCE(max(seq), 0) FROM sqlite_sequence WHERE name='tx_changes') AS seq""")
+    return None if v.empty else tuple(str(x) for x in v.iloc[0])
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def build_monthly_matrix(_df, version):
+    # Monats-Aggregat (Monat x Kategorie) für Budget und Ausgaben, lückenlos über alle Monate.
+    # Gecacht je Datenstand (version), ein Wechsel von Monat/Vergleich/Ø rechnet nur noch compare_period
+    d = _df[_df['type'].isin(['SOLL','IST'])]
+    if d.empty: return pd.DataFrame(), pd.DataFrame()
+    k = d['sort_key_month'].to_numpy(dtype=np.int64)
+    month = pd.Series(k // 100 * 12 + k % 100 - 1, index=d.index, name='month')  # fortlaufende Monatsnummer statt Datums-Parsing
+    agg = d.groupby([month, 'category', 'type'])['amount'].sum().unstack(['type', 'category'], fill_value=0.0)
+    agg = agg.reindex(range(agg.index.min(), agg.index.max() + 1), fill_value=0.0)
+    first = int(agg.index[0])
+    months = pd.period_range(pd.Period(year=first // 12, month=first % 12 + 1, freq='M'), periods=len(agg), freq='M')
+    agg.index = months
+    cats = agg.columns.get_level_values('category').unique()
+    budget = agg['SOLL'].reindex(columns=cats, fill_value=0.0) if 'SOLL' in agg.columns.get_level_values('type') else pd.DataFrame(0.0, index=months, columns=cats)
+    spent = agg['IST'].reindex(columns=cats, fill_value=0.0) if 'IST' in agg.columns.get_level_values('type') else pd.DataFrame(0.0, index=months, columns=cats)
+    budget['Gesamt'] = budget.sum(axis=1)
+    spent['Gesamt'] = spent.sum(axis=1)
+    return budget, spent
+
+def compare_period(budget, spent, month, lag, window):
+    # Vergleich eines Monats mit dem Monat 'lag' Monate davor plus gleitender Durchschnitt über 'window' Monate
+    prev = month - lag
+    roll = spent.rolling(window, min_periods=1).mean()
+    get = lambda m_df, m: m_df.loc[m] if m in m_df.index else pd.Series(0.0, index=m_df.columns)
+    res = pd.DataFrame({
+        'Budget': get(budget, month), 'Ausgaben': get(spent, month),
+        'Budget_Vgl': get(budget, prev), 'Ausgaben_Vgl': get(spent, prev),
+        'Schnitt': get(roll, month)
+    })
+    res['Delta'] = res['Ausgaben'] - res['Ausgaben_Vgl']
+    # Ohne Ausgaben im Vergleichsmonat gibt es keine Prozent-Veränderung -> NaN (leer in der Tabelle)
+    res['Delta_Pct'] = res['Delta'] / res['Ausgaben_Vgl'].where(res['Ausgaben_Vgl'] != 0)
+    res['Abw_Schnitt'] = res['Ausgaben'] - res['Schnitt']
+    return res
+
+CYCLE_MONTHS = {"Monatlich": 1, "Vierteljährlich": 3, "Halbjährlich": 6, "Jährlich": 12}
+
+def build_fixed_flows(start, horizon, inc_df, subs_df, loans_df):
+    # Tagesvektor (Länge horizon, Tag 0 = start) mit allen festen Zahlungen: Einnahmen, Abos, Kreditraten
+    flows = np.zeros(horizon)
+    end = start + timedelta(days=horizon - 1)
+    def book(day, months_from, amount, first=None, last=None, every=1):
+        m = date(start.year, start.month, 1)
+        while m <= end:
+            d = date(m.year, m.month, min(int(day), calendar.monthrange(m.year, m.month)[1]))
+            due = months_from is None or ((m.year - months_from.year) * 12 + m.month - months_from.month) % every == 0
+            if due and start <= d <= end and (first is None or d >= first) and (last is None or d <= last):
+                flows[(d - start).days] += amount
+            m += relativedelta(months=1)
+    if not inc_df.empty:
+        for _, r in inc_df.dropna(subset=['day_of_month', 'amount']).iterrows(): book(r['day_of_month'], None, r['amount'])
+    if not subs_df.empty:
+        for _, r in subs_df.dropna(subset=['start_date', 'amount']).iterrows():
+            sd = r['start_date'].date()
+            book(sd.day, sd, -r['amount'], first=sd, every=CYCLE_MONTHS.get(r['cycle'], 1))
+    if not loans_df.empty:
+        for _, r in loans_df.dropna(subset=['start_date', 'monthly_payment', 'term_months']).iterrows():
+            sd = r['start_date'].date()
+            # term_months Raten: erste am Starttag, letzte term_months - 1 Monate später
+            book(sd.day, None, -r['monthly_payment'], first=sd, last=sd + relativedelta(months=int(r['term_months']) - 1))
+    return flows
+
+def build_daily_spending(df, variable_cats, until, days=365):
+    # Historie (Tag x Kategorie) der IST-Ausgaben variabler Kategorien, lückenlos inkl. Null-Tagen
+    since = pd.Timestamp(until) - pd.Timedelta(days=days - 1)
+    d = df[(df['type'] == 'IST') & df['category'].isin(variable_cats) & (df['date'] >= since) & (df['date'] <= pd.Timestamp(until))]
+    if d.empty: return np.zeros((0, 0)), []
+    m = d.groupby([d['date'].dt.normalize(), 'category'])['amount'].sum().unstack(fill_value=0.0)
+    m = m.reindex(pd.date_range(m.index.min(), pd.Timestamp(until), freq='D'), fill_value=0.0)
+    return m.to_numpy(dtype=np.float64), list(m.columns)
+
+def simulate_balance(start_balance, fixed_flows, daily_hist, n_paths=10000, seed=None):
+    # Bootstrap: pro Pfad und Tag wird ein historischer Tag gezogen (alle Kategorien gemeinsam,
+    # so bleiben Zusammenhänge wie "Großeinkauf + Tanken am Samstag" erhalten)
+    rng = np.random.default_rng(seed)
+    horizon = len(fixed_flows)
+    if daily_hist.size == 0: return np.full((n_paths, horizon), start_balance + np.cumsum(fixed_flows))
+    day_total = daily_hist.sum(axis=1)
+    spend = day_total[rng.integers(0, len(day_total), size=(n_paths, horizon), dtype=np.int32)]
+    return start_balance + np.cumsum(fixed_flows[None, :] - spend, axis=1)
+
+def window_min(a, w):
+    # Gleitendes Minimum über die letzten w Zeilen (axis 0), blockweise Präfix-/Suffix-Minima (van Herk/Gil-Werman)
+    rows = a.shape[0]
+    p = -(-rows // w) * w
+    pad = np.full((p,) + a.shape[1:], np.inf)
+    pad[:rows] = a
+    blk = pad.reshape((p // w, w) + a.shape[1:])
+    pre = np.minimum.accumulate(blk, axis=1).reshape(pad.shape)[:rows]
+    suf = np.minimum.accumulate(blk[:, ::-1], axis=1)[:, ::-1].reshape(pad.shape)
+    out = pre.copy()
+    out[w - 1:] = np.minimum(suf[:rows - w + 1], pre[w - 1:])
+    return out
+
+def min_notes_table(max_units, notes, limits=None):
+    # T[i] = minimale Scheinzahl für i Einheiten, K[s][i] = Anzahl von notes[s] in dieser Lösung (nur unbegrenzt).
+    # Je Schein n werden die Restklassen mod n als Spalten betrachtet: T_neu[j] = j + min_{j-L <= i <= j} (T[i] - i)
+    t = np.full(max_units + 1, np.inf)
+    t[0] = 0
+    ks = [None] * len(notes)
+    for s in reversed(range(len(notes))):
+        n, lim = notes[s], None if limits is None else int(limits[s])
+        if lim == 0: continue
+        rows = -(-(max_units + 1) // n)
+        col = np.full(rows * n, np.inf)
+        col[:max_units + 1] = t
+        j = np.arange(rows)[:, None]
+        v = col.reshape(rows, n) - j
+        if lim is None or lim >= rows - 1:
+            m = np.minimum.accumulate(v, axis=0)
+            # Index des (ersten) Minimums -> bei Gleichstand möglichst viele große Scheine
+            prev = np.vstack([np.full((1, n), np.inf), m[:-1]])
+            k = j - np.maximum.accumulate(np.where(v < prev, j, 0), axis=0)
+            ks[s] = k.ravel()[:max_units + 1]
+        else:
+            m = window_min(v, lim + 1)
+        t = (m + j).ravel()[:max_units + 1]
+    return t, ks
+
+def plan_notes(amounts, notes=VERTEILER_NOTES, inventory=None):
+    # Stückelung für alle Umschläge gleichzeitig: möglichst wenige Scheine, optional begrenzt durch den Bestand.
+    # Rückgabe: Scheinanzahl (Kategorie x Schein, absteigend) und der nicht in Scheinen darstellbare Rest (digital).
+    if inventory is not None: inventory = [dict(zip(notes, inventory))[n] for n in sorted(notes, reverse=True)]
+    notes = sorted(notes, reverse=True)
+    amounts = np.maximum(np.nan_to_num(np.asarray(amounts, dtype=float)), 0.0)
+    unit = int(np.gcd.reduce(notes))
+    nu = [n // unit for n in notes]
+    units = np.floor(amounts / unit + 1e-9).astype(np.int64)
+    counts = np.zeros((len(amounts), len(notes)), dtype=np.int64)
+    if len(amounts) == 0: return counts, amounts
+
+    # Ohne Bestandsgrenze: eine gemeinsame DP-Tabelle, Rückverfolgung für alle Kategorien vektorisiert
+    t, ks = min_notes_table(int(units.max()), nu)
+    reach = np.maximum.accumulate(np.where(np.isfinite(t), np.arange(len(t)), 0))
+    u = reach[units]
+    for s, n in enumerate(nu):
+        counts[:, s] = ks[s][u]
+        u -= counts[:, s] * n
+
+    if inventory is not None:
+        # Mit Bestand: kleine Beträge zuerst; passt die freie Lösung nicht mehr in den Restbestand,
+        # beschränkte DP über den Restbestand (größter bar darstellbarer Betrag, dann wenigste Scheine)
+        left = np.asarray(inventory, dtype=np.int64).copy()
+        for c in np.argsort(units, kind="stable"):
+            if (counts[c] <= left).all():
+                left -= counts[c]
+                continue
+            t, _ = min_notes_table(int(units[c]), nu, left)
+            ok = np.flatnonzero(np.isfinite(t))
+            u, row = int(ok[-1]), np.zeros(len(nu), dtype=np.int64)
+            for s, n in enumerate(nu):
+                t_rest, _ = min_notes_table(u, nu[s + 1:], left[s + 1:])
+                k = np.arange(min(left[s], u // n) + 1)
+                cost = k + t_rest[u - k * n]
+                row[s] = k[len(k) - 1 - np.argmin(cost[::-1])]
+                u -= row[s] * n
+            counts[c] = row
+            left -= row
+    return counts, amounts - (counts * np.asarray(notes)[None, :]).sum(axis=1)
+
 def get_categories_full():
     df = get_data("SELECT * FROM categories ORDER BY name ASC")
     cols = ['is_fixed', 'is_cashless', 'default_budget']
@@ -145,6 +508,7 @@ try: init_db()
 except: pass
 
 # --- UI START ---
+data_version = get_data_version()  # vor dem Laden: df ist mindestens so neu wie der Cache-Schlüssel
 df = load_main_data()
 cat_df = get_categories_full()
 current_categories = cat_df['name'].tolist() if not cat_df.empty else []
@@ -158,7 +522,7 @@ if df.empty and not current_categories:
     st.info("Start: Lege im Reiter '⚙️ Admin' (ganz rechts/unten) Kategorien an.")
 else:
     # 9 Tabs
-    tab_dash, tab_book, tab_dist, tab_sf, tab_subs, tab_loans, tab_forecast, tab_ana, tab_admin, tab_help = st.tabs(["📊 Übersicht", "📝 Buchen", "💰 Verteiler", "🎯 Ziele", "🔄 Abos", "📉 Kredite", "🔮 Prognose", "📈 Analyse", "⚙️ Admin", "📖 Hilfe"])
+    tab_dash, tab_book, tab_dist, tab_sf, tab_subs, tab_loans, tab_forecast, tab_ana, tab_cmp, tab_admin, tab_help = st.tabs(["📊 Übersicht", "📝 Buchen", "💰 Verteiler", "🎯 Ziele", "🔄 Abos", "📉 Kredite", "🔮 Prognose", "📈 Analyse", "⚖️ Vergleich", "⚙️ Admin", "📖 Hilfe"])
 
     # 1. DASHBOARD
     with tab_dash:
@@ -168,7 +532,7 @@ else:
         l_df = get_data("SELECT * FROM loans")
         loan_monthly = 0.0
         if not l_df.empty:
-            l_df['start_date'] = pd.to_datetime(l_df['start_date'], errors='coerce')
+            l_df['start_date'] = parse_db_dates(l_df['start_date'])
             today = date.today()
             def is_active(row):
                 if pd.isnull(row['start_date']): return False
@@ -278,7 +642,7 @@ else:
                     nm = (today.replace(day=1) + timedelta(days=32)).replace(day=1)
                     opt1, opt2 = f"{DE_MONTHS[today.month]} {today.year}", f"{DE_MONTHS[nm.month]} {nm.year}"
                     bm_sel = st.radio("Ziel-Monat", [opt1, opt2], horizontal=True)
-                    budget_target = today.strftime("%Y-%m") if bm_sel == opt1 else nm.strftime("%Y-%m")
+                    budget_target = to_db_month(today if bm_sel == opt1 else nm)
                 
                 if current_categories:
                     cat_input = st.selectbox("Kategorie", current_categories)
@@ -296,7 +660,7 @@ else:
                     
                     if st.form_submit_button("Speichern", use_container_width=True):
                         execute_db("INSERT INTO transactions (date, category, description, amount, type, budget_month, is_online) VALUES (?,?,?,?,?,?,?)",
-                                   (date_input, cat_input, desc_input, amt_input, "SOLL" if "SOLL" in type_input else "IST", budget_target, 1 if is_online else 0))
+                                   (to_db_date(date_input), cat_input, desc_input, amt_input, "SOLL" if "SOLL" in type_input else "IST", budget_target, 1 if is_online else 0))
                         st.toast("✅ Gespeichert!")
                         st.rerun()
                 else: st.error("Bitte erst Kategorien im Admin-Bereich anlegen!")
@@ -309,9 +673,9 @@ else:
                 t_amt = st.number_input("Betrag", min_value=0.01, format="%.2f")
                 if st.form_submit_button("Umbuchen", use_container_width=True):
                     if c_from != c_to:
-                        d_s = t_date.strftime("%Y-%m")
-                        execute_db("INSERT INTO transactions (date, category, description, amount, type, budget_month) VALUES (?,?,?,?,?,?)", (t_date, c_from, f"Zu {c_to}", -t_amt, "SOLL", d_s))
-                        execute_db("INSERT INTO transactions (date, category, description, amount, type, budget_month) VALUES (?,?,?,?,?,?)", (t_date, c_to, f"Von {c_from}", t_amt, "SOLL", d_s))
+                        d_s = to_db_month(t_date)
+                        execute_db("INSERT INTO transactions (date, category, description, amount, type, budget_month) VALUES (?,?,?,?,?,?)", (to_db_date(t_date), c_from, f"Zu {c_to}", -t_amt, "SOLL", d_s))
+                        execute_db("INSERT INTO transactions (date, category, description, amount, type, budget_month) VALUES (?,?,?,?,?,?)", (to_db_date(t_date), c_to, f"Von {c_from}", t_amt, "SOLL", d_s))
                         st.success("✅ Erledigt")
                         st.rerun()
                     else: st.error("Identisch.")
@@ -327,7 +691,7 @@ else:
             st.metric("Im Umschlag (muss zur Bank)", format_euro(bal))
             if bal > 0:
                 if st.button("Geld eingezahlt (Reset)", type="primary", use_container_width=True):
-                    execute_db("INSERT INTO transactions (date, category, description, amount, type, budget_month) VALUES (?,?,?,?,?,?)", (date.today(), "Back to Bank", "Einzahlung", bal, "BANK_DEPOSIT", date.today().strftime("%Y-%m")))
+                    execute_db("INSERT INTO transactions (date, category, description, amount, type, budget_month) VALUES (?,?,?,?,?,?)", (to_db_date(date.today()), "Back to Bank", "Einzahlung", bal, "BANK_DEPOSIT", to_db_month(date.today())))
                     st.toast("Eingezahlt!")
                     st.rerun()
             else: st.success("Leer.")
@@ -335,15 +699,10 @@ else:
         with st_b4:
             st.subheader("Scheinrechner")
             target_val = st.number_input("Betrag", min_value=0, value=500, step=50)
-            notes = [200, 100, 50, 20, 10, 5]
-            result = {}
-            remainder = target_val
-            for n in notes:
-                count = int(remainder // n)
-                if count > 0:
-                    result[n] = count
-                    remainder -= count * n
-            for n, c in result.items(): st.write(f"**{c}x** {n} €")
+            note_counts, note_rest = plan_notes([target_val], ALL_NOTES)
+            for n, c in zip(ALL_NOTES, note_counts[0]):
+                if c > 0: st.write(f"**{c}x** {n} €")
+            if note_rest[0] > 0: st.caption(f"Rest (Münzen/digital): {format_euro(note_rest[0])}")
 
     # 3. VERTEILER
     with tab_dist:
@@ -353,7 +712,7 @@ else:
         nm = (today.replace(day=1) + timedelta(days=32)).replace(day=1)
         opt1, opt2 = f"{DE_MONTHS[today.month]} {today.year}", f"{DE_MONTHS[nm.month]} {nm.year}"
         bulk_target_sel = st.radio("Ziel-Monat", [opt1, opt2], horizontal=True)
-        bulk_month = today.strftime("%Y-%m") if bulk_target_sel == opt1 else nm.strftime("%Y-%m")
+        bulk_month = to_db_month(today if bulk_target_sel == opt1 else nm)
 
         if "bulk_df" not in st.session_state or len(st.session_state.bulk_df) != len(cat_df):
             temp = cat_df[['name', 'is_fixed', 'is_cashless', 'default_budget']].copy()
@@ -361,6 +720,25 @@ else:
             temp['50er'] = 0; temp['20er'] = 0; temp['10er'] = 0; temp['5er'] = 0; temp['Notiz'] = ""
             st.session_state.bulk_df = temp
 
+        with st.expander("🧮 Scheine automatisch planen"):
+            st.caption("Stückelt die Summen aller bar geführten Umschläge (ohne Fix/Karte) mit möglichst wenigen Scheinen. Was nicht in Scheinen aufgeht, landet in Rest/Dig.")
+            inv = None
+            if st.checkbox("Vorhandene Scheine berücksichtigen", help="Vorbelegt mit den zuletzt verteilten Scheinen (letzte Verteiler-Buchung), nicht mit einem Bestand – bitte auf die tatsächlich abgehobenen Scheine anpassen"):
+                last_den = get_data("SELECT c50, c20, c10, c5 FROM denominations ORDER BY id DESC LIMIT 1")
+                inv_cols = st.columns(len(VERTEILER_NOTES))
+                inv = [inv_cols[i].number_input(f"{n} €", min_value=0, step=1, value=int(last_den[f"c{n}"].iloc[0] or 0) if not last_den.empty else 0, key=f"inv_{n}") for i, n in enumerate(VERTEILER_NOTES)]
+            if st.button("Scheine planen", use_container_width=True):
+                plan_df = st.session_state.bulk_df.copy()
+                note_cols = [f"{n}er" for n in VERTEILER_NOTES]
+                sums = (plan_df[note_cols] * VERTEILER_NOTES).sum(axis=1) + plan_df['Rest_Betrag'].fillna(0)
+                cash_rows = (plan_df['is_fixed'] == 0) & (plan_df['is_cashless'] == 0)
+                note_counts, note_rest = plan_notes(sums[cash_rows], VERTEILER_NOTES, inv)
+                plan_df.loc[cash_rows, note_cols] = note_counts
+                plan_df.loc[cash_rows, 'Rest_Betrag'] = note_rest.round(2)
+                st.session_state.bulk_df = plan_df
+                if note_rest.sum() > 0: st.toast(f"Nicht in Scheinen: {format_euro(note_rest.sum())}")
+                st.rerun()
+
         calc_df = st.session_state.bulk_df.copy()
         calc_df['Summe'] = (calc_df['50er']*50) + (calc_df['20er']*20) + (calc_df['10er']*10) + (calc_df['5er']*5) + calc_df['Rest_Betrag']
         
@@ -404,11 +782,11 @@ else:
                     if row_sum > 0:
                         desc = "Verteiler" + (f": {row['Notiz']}" if row['Notiz'] else "")
                         execute_db("INSERT INTO transactions (date, category, description, amount, type, budget_month, is_online) VALUES (?,?,?,?,?,?,?)",
-                                   (bulk_date, row["Kategorie"], desc, row_sum, "SOLL", bulk_month, 0))
+                                   (to_db_date(bulk_date), row["Kategorie"], desc, row_sum, "SOLL", bulk_month, 0))
                         c += 1
                 if cash_total > 0:
-                    execute_db("INSERT INTO denominations (date, total_amount, c200, c100, c50, c20, c10, c5) VALUES (?,?,?,0,0,?,?,?,?)",
-                               (bulk_date.strftime("%Y-%m-%d"), cash_total, 0, int(sum_50), int(sum_20), int(sum_10), int(sum_5)))
+                    execute_db("INSERT INTO denominations (date, total_amount, c200, c100, c50, c20, c10, c5) VALUES (?,?,0,0,?,?,?,?)",
+                               (to_db_date(bulk_date), float(cash_total), int(sum_50), int(sum_20), int(sum_10), int(sum_5)))
                 st.success(f"✅ {c} Budgets gebucht!")
                 temp = cat_df[['name', 'is_fixed', 'is_cashless', 'default_budget']].copy()
                 temp.columns = ['Kategorie', 'is_fixed', 'is_cashless', 'Rest_Betrag']
@@ -427,7 +805,7 @@ else:
         sfd = cat_df.set_index('name').copy()
         sfd['Aktuell'] = sfc
         sfd['Aktuell'] = sfd['Aktuell'].fillna(0.0)
-        sfd['due_date'] = pd.to_datetime(sfd['due_date'], errors='coerce')
+        sfd['due_date'] = parse_db_dates(sfd['due_date'])
         
         def cr(row):
             t = row['target_amount']
@@ -443,9 +821,9 @@ else:
             if m < 1: m = 1
             return (t-c)/m, f"{m} M"
 
-        re = sfd.apply(cr, axis=1, result_type='expand')
-        sfd['Rate'] = re[0]
-        sfd['Info'] = re[1]
+        rates = sfd.apply(cr, axis=1, result_type='expand')
+        sfd['Rate'] = rates[0]
+        sfd['Info'] = rates[1]
         
         total_monthly_need = sfd[sfd['target_amount'] > 0]['Rate'].sum()
         prio_sums = sfd[sfd['target_amount'] > 0].groupby('priority')['Rate'].sum()
@@ -479,9 +857,7 @@ else:
                         nt = ch.get("target_amount", g.iloc[i]['target_amount'])
                         nd = ch.get("due_date", g.iloc[i]['due_date'])
                         nn = ch.get("notes", g.iloc[i]['notes'])
-                        if pd.isnull(nd): nd = None
-                        elif isinstance(nd, (datetime.date, datetime.datetime, pd.Timestamp)): nd = nd.strftime("%Y-%m-%d")
-                        execute_db("UPDATE categories SET target_amount=?, due_date=?, notes=? WHERE name=?", (nt, nd, nn, cn))
+                        execute_db("UPDATE categories SET target_amount=?, due_date=?, notes=? WHERE name=?", (nt, to_db_date(nd), nn, cn))
                     st.rerun()
 
     # 5. ABOS
@@ -491,7 +867,7 @@ else:
         
         # Oben KPIs
         if not subs_df.empty:
-            subs_df['start_date'] = pd.to_datetime(subs_df['start_date'], errors='coerce')
+            subs_df['start_date'] = parse_db_dates(subs_df['start_date'])
             def calc_monthly_cost(row):
                 amt = row['amount']
                 if row['cycle'] == "Jährlich": return amt / 12
@@ -529,17 +905,21 @@ else:
         if st.session_state.get("sub_editor_main"):
             ch = st.session_state["sub_editor_main"]
             for i in ch["deleted_rows"]: execute_db("DELETE FROM subscriptions WHERE id=?", (int(subs_df.iloc[i]['id']),))
+            bad_edit = False
             for i, v in ch["edited_rows"].items():
                 sid = subs_df.iloc[i]['id']
                 for k, val in v.items():
                     if k == 'start_date':
-                         if pd.isnull(val): val = None
-                         elif isinstance(val, (datetime.date, datetime.datetime, pd.Timestamp)): val = val.strftime("%Y-%m-%d")
+                        if to_db_date(val) is None and val not in (None, ""):
+                            st.error(f"Ungültiges Startdatum '{val}'.")
+                            bad_edit = True
+                            continue
+                        val = to_db_date(val)
                     execute_db(f"UPDATE subscriptions SET {k}=? WHERE id=?", (val, int(sid)))
             for r in ch["added_rows"]:
                 execute_db("INSERT INTO subscriptions (name, category, amount, cycle, start_date) VALUES (?,?,?,?,?)", 
-                           (r.get("name","Neu"), r.get("category","Sonstiges"), r.get("amount",0), r.get("cycle","Monatlich"), date.today()))
-            if ch["deleted_rows"] or ch["edited_rows"] or ch["added_rows"]: st.rerun()
+                           (r.get("name","Neu"), r.get("category","Sonstiges"), r.get("amount",0), r.get("cycle","Monatlich"), to_db_date(r.get("start_date") or date.today())))
+            if (ch["deleted_rows"] or ch["edited_rows"] or ch["added_rows"]) and not bad_edit: st.rerun()
 
     # 6. KREDITE
     with tab_loans:
@@ -570,13 +950,13 @@ else:
                         int_sum = nl_val; rate = (nl_sum + int_sum) / nl_months
                         
                     execute_db("INSERT INTO loans (name, start_date, total_amount, interest_amount, term_months, monthly_payment) VALUES (?,?,?,?,?,?)",
-                               (nl_name, nl_start, nl_sum, int_sum, nl_months, rate))
+                               (nl_name, to_db_date(nl_start), nl_sum, int_sum, nl_months, rate))
                     st.success("Kredit angelegt!")
                     st.rerun()
         # -----------------------------------------------
 
         if not loans_df.empty:
-            loans_df['start_date'] = pd.to_datetime(loans_df['start_date'], errors='coerce')
+            loans_df['start_date'] = parse_db_dates(loans_df['start_date'])
             
             # SAFE Calculation Function
             def calc_loan(row):
@@ -653,15 +1033,21 @@ else:
                 chg = st.session_state["loan_editor"]
                 for i in chg["deleted_rows"]: 
                     execute_db("DELETE FROM loans WHERE id=?", (int(loans_df.iloc[i]['id']),))
+                bad_edit = False
                 for i, v in chg["edited_rows"].items():
                     lid = loans_df.iloc[i]['id']
                     for k, val in v.items():
-                        if k == 'start_date' and isinstance(val, (datetime.datetime, pd.Timestamp)): val = val.strftime("%Y-%m-%d")
+                        if k == 'start_date':
+                            if to_db_date(val) is None and val not in (None, ""):
+                                st.error(f"Ungültiges Startdatum '{val}'.")
+                                bad_edit = True
+                                continue
+                            val = to_db_date(val)
                         execute_db(f"UPDATE loans SET {k}=? WHERE id=?", (val, int(lid)))
                 if chg["added_rows"]:
                     for row in chg["added_rows"]:
-                        execute_db("INSERT INTO loans (name, start_date, total_amount, interest_amount, term_months, monthly_payment) VALUES (?,?,?,?,?,?)", (row.get("name","Neu"), row.get("start_date",date.today()), row.get("total_amount",0), row.get("interest_amount",0), row.get("term_months",12), row.get("monthly_payment",0)))
-                if chg["deleted_rows"] or chg["edited_rows"] or chg["added_rows"]: st.rerun()
+                        execute_db("INSERT INTO loans (name, start_date, total_amount, interest_amount, term_months, monthly_payment) VALUES (?,?,?,?,?,?)", (row.get("name","Neu"), to_db_date(row.get("start_date") or date.today()), row.get("total_amount",0), row.get("interest_amount",0), row.get("term_months",12), row.get("monthly_payment",0)))
+                if (chg["deleted_rows"] or chg["edited_rows"] or chg["added_rows"]) and not bad_edit: st.rerun()
 
     # 7. PROGNOSE (REDUZIERT AUF CHART + Einnahmen)
     with tab_forecast:
@@ -689,7 +1075,7 @@ else:
         # Abos (aus DB)
         subs = get_data("SELECT * FROM subscriptions")
         if not subs.empty:
-            subs['start_date'] = pd.to_datetime(subs['start_date'], errors='coerce')
+            subs['start_date'] = parse_db_dates(subs['start_date'])
             for _, r in subs.iterrows():
                 try: 
                     include = False
@@ -704,7 +1090,7 @@ else:
         # Kredite (aus DB)
         l_df = get_data("SELECT * FROM loans") # Reload to be safe
         if not l_df.empty:
-             l_df['start_date'] = pd.to_datetime(l_df['start_date'], errors='coerce')
+             l_df['start_date'] = parse_db_dates(l_df['start_date'])
              # Re-Calculate Active Loans logic simple here
              for _, r in l_df.iterrows():
                  if pd.notnull(r['start_date']):
@@ -730,6 +1116,34 @@ else:
         fig.add_hrect(y0=-100000, y1=0, line_width=0, fillcolor="red", opacity=0.1)
         st.plotly_chart(fig, use_container_width=True)
 
+        st.divider()
+        st.markdown("#### 🎲 Was-wäre-wenn (inkl. variabler Ausgaben)")
+        if st.checkbox("Simulation berechnen", help="Zieht die täglichen IST-Ausgaben der variablen Kategorien (ohne Fixkosten) zufällig aus den letzten 365 Tagen."):
+            cs1, cs2 = st.columns(2)
+            horizon = cs1.select_slider("Horizont (Tage)", options=[30, 90, 180, 365], value=90)
+            n_paths = cs2.select_slider("Pfade", options=[1000, 5000, 10000], value=10000)
+            variable_cats = cat_df[cat_df['is_fixed'] == 0]['name'].tolist()
+            daily_hist, _ = build_daily_spending(df, variable_cats, today) if not df.empty else (np.zeros((0, 0)), [])
+            fixed = build_fixed_flows(today, horizon, inc_df, subs, l_df)
+            paths = simulate_balance(start_saldo, fixed, daily_hist, n_paths)
+            pct = np.percentile(paths, [5, 25, 50, 75, 95], axis=0)
+            p_neg = (paths.min(axis=1) < 0).mean()
+
+            m1, m2, m3 = st.columns(3)
+            m1.metric("Risiko Minus", f"{p_neg*100:.1f}%", help="Anteil der Pfade, die im Horizont mindestens einmal unter 0 € fallen")
+            m2.metric("Saldo Ende (Median)", format_euro(pct[2, -1]))
+            m3.metric("Saldo Ende (5%-Fall)", format_euro(pct[0, -1]))
+
+            days = pd.date_range(today, periods=horizon, freq='D')
+            fig_mc = go.Figure()
+            for lo, hi, name, alpha in [(0, 4, "5–95%", 0.15), (1, 3, "25–75%", 0.3)]:
+                fig_mc.add_trace(go.Scatter(x=days, y=pct[lo], mode='lines', line=dict(width=0), showlegend=False, hoverinfo='skip'))
+                fig_mc.add_trace(go.Scatter(x=days, y=pct[hi], mode='lines', line=dict(width=0), fill='tonexty', fillcolor=f"rgba(31,119,180,{alpha})", name=name))
+            fig_mc.add_trace(go.Scatter(x=days, y=pct[2], mode='lines', line=dict(color="#1f77b4"), name="Median"))
+            fig_mc.add_hrect(y0=min(pct[0].min(), 0), y1=0, line_width=0, fillcolor="red", opacity=0.1)
+            fig_mc.update_layout(title=f"{n_paths} Pfade über {horizon} Tage", yaxis_title="Saldo", hovermode="x unified")
+            st.plotly_chart(fig_mc, use_container_width=True)
+
         st.divider()
         st.markdown("#### 📝 Einnahmen verwalten")
         
@@ -766,7 +1180,68 @@ else:
             with c1: st.plotly_chart(px.pie(di, values='amount', names='category', title='Kategorien'), use_container_width=True)
             with c2: st.plotly_chart(px.bar(di.groupby(['budget_month','category'])['amount'].sum().reset_index(), x='budget_month', y='amount', color='category', title='Trend'), use_container_width=True)
 
-    # 9. ADMIN
+            st.divider()
+            st.markdown("##### ✉️ Umschlag-Verlauf")
+            ch1, ch2 = st.columns([1, 3])
+            asof_day = ch1.date_input("Stand am", date.today(), format="DD.MM.YYYY")
+            hist_cats = ch2.multiselect("Kategorien", current_categories, default=current_categories[:3], placeholder="Kategorien wählen")
+            asof = get_balances_asof(asof_day)
+            if not asof.empty:
+                asof = asof[asof['category'].isin(current_categories)]
+                ch1.dataframe(asof, hide_index=True, use_container_width=True, column_config={"category": "Kategorie", "balance": st.column_config.NumberColumn("Stand", format="%.2f €")})
+            hist = get_balance_history(hist_cats)
+            if not hist.empty:
+                fig = px.line(hist, x='day', y='balance', color='category', line_shape='hv', title='Saldo je Umschlag', labels={'day': 'Datum', 'balance': 'Saldo', 'category': 'Kategorie'})
+                fig.add_vline(x=pd.Timestamp(asof_day).timestamp() * 1000, line_dash="dot", opacity=0.5)
+                ch2.plotly_chart(fig, use_container_width=True)
+
+    # 9. VERGLEICH
+    with tab_cmp:
+        st.subheader("⚖️ Vergleich")
+        if df.empty: st.info("Leer.")
+        else:
+            m_budget, m_spent = build_monthly_matrix(df, data_version)
+            if m_spent.empty: st.info("Keine Budget- oder Ausgabendaten.")
+            else:
+                cc1, cc2, cc3 = st.columns([2, 2, 1])
+                m_list = list(m_spent.index[::-1])
+                sel_p = cc1.selectbox("Monat", m_list, format_func=lambda p: f"{DE_MONTHS[p.month]} {p.year}")
+                cmp_mode = cc2.radio("Vergleich mit", ["Vormonat", "Vorjahr"], horizontal=True)
+                win = cc3.selectbox("Ø Monate", [3, 6, 12])
+                lag = 1 if cmp_mode == "Vormonat" else 12
+                prev_p = sel_p - lag
+
+                cmp = compare_period(m_budget, m_spent, sel_p, lag, win)
+                tot = cmp.loc['Gesamt']
+                k1, k2, k3 = st.columns(3)
+                k1.metric("Budget", format_euro(tot['Budget']), delta=format_euro(tot['Budget'] - tot['Budget_Vgl']), delta_color="off")
+                pct_txt = "–" if tot['Ausgaben_Vgl'] == 0 else f"{tot['Delta_Pct']*100:+.1f}%"
+                k2.metric("Ausgaben", format_euro(tot['Ausgaben']), delta=f"{format_euro(tot['Delta'])} ({pct_txt})", delta_color="inverse")
+                k3.metric(f"Ø {win} Monate", format_euro(tot['Schnitt']), delta=format_euro(tot['Abw_Schnitt']), delta_color="inverse")
+
+                vgl_label = f"{DE_MONTHS[prev_p.month]} {prev_p.year}"
+                cmp_cfg = {
+                    "Budget": st.column_config.NumberColumn(format="%.2f €"),
+                    "Ausgaben": st.column_config.NumberColumn(format="%.2f €"),
+                    "Budget_Vgl": st.column_config.NumberColumn(f"Budget {vgl_label}", format="%.2f €"),
+                    "Ausgaben_Vgl": st.column_config.NumberColumn(f"Ausgaben {vgl_label}", format="%.2f €"),
+                    "Delta": st.column_config.NumberColumn("Δ €", format="%.2f €"),
+                    "Delta_Pct": st.column_config.NumberColumn("Δ %", format="percent"),
+                    "Schnitt": st.column_config.NumberColumn(f"Ø {win} M", format="%.2f €"),
+                    "Abw_Schnitt": st.column_config.NumberColumn("Δ Ø", format="%.2f €")
+                }
+                st.dataframe(cmp.sort_values('Ausgaben', ascending=False), use_container_width=True, column_config=cmp_cfg)
+
+                cmp_cat = st.selectbox("Verlauf für", ["Gesamt"] + [c for c in m_spent.columns if c != "Gesamt"])
+                trend = pd.DataFrame({
+                    'Budget': m_budget[cmp_cat], 'Ausgaben': m_spent[cmp_cat],
+                    f'Ø {win} M': m_spent[cmp_cat].rolling(win, min_periods=1).mean()
+                })
+                trend.index = trend.index.to_timestamp()
+                fig = px.line(trend.reset_index(names='Monat'), x='Monat', y=list(trend.columns), markers=True, title=cmp_cat)
+                st.plotly_chart(fig, use_container_width=True)
+
+    # 10. ADMIN
     with tab_admin:
         st.subheader("⚙️ Admin & Daten")
         
@@ -806,10 +1281,30 @@ else:
                 st.caption("Liste")
                 st.dataframe(cat_df, hide_index=True, use_container_width=True)
 
+        st.divider()
+        st.subheader("🔍 Suche")
+        search_term = st.text_input("Suchbegriff", placeholder="z.B. Rewe, Tanken, Geschenk ...", label_visibility="collapsed")
+        if search_term:
+            page_size = 25
+            total_hits = count_search_hits(search_term)
+            if total_hits == 0: st.info("Keine Treffer.")
+            else:
+                pages = (total_hits - 1) // page_size + 1
+                cs1, cs2 = st.columns([3, 1])
+                page = cs2.number_input("Seite", min_value=1, max_value=pages, value=1, step=1)
+                ranked = total_hits <= SEARCH_RANK_MAX_HITS
+                cs1.caption(f"{total_hits} Treffer · Seite {page}/{pages}" + ("" if ranked else " · neueste zuerst, Suche verfeinern für Relevanz-Sortierung"))
+                hits = search_transactions(search_term, page_size, (page - 1) * page_size, ranked)
+                hits['date'] = parse_db_dates(hits['date'])
+                hits['M'] = hits['is_online'].apply(lambda x: "💳" if x==1 else "💵")
+                st.dataframe(hits[['date','category','description','amount','type','M']], use_container_width=True, hide_index=True, column_config={"amount": st.column_config.NumberColumn(format="%.2f €"), "date": st.column_config.DateColumn(format="DD.MM.YYYY")})
+
         st.divider()
         st.subheader("Rohdaten")
         de = get_data("SELECT * FROM transactions ORDER BY date DESC, id DESC")
-        if not de.empty: de['date'] = pd.to_datetime(de['date'], errors='coerce')
+        if not de.empty: de['date'] = parse_db_dates(de['date'])
+        bad_dates = get_data("SELECT CAST(value AS INTEGER) AS n FROM sync_state WHERE key='bad_dates'")
+        if not bad_dates.empty and bad_dates['n'].iloc[0] > 0: st.warning(f"{int(bad_dates['n'].iloc[0])} Buchungen mit ungültigem Datum werden in Auswertungen ignoriert. Bitte hier korrigieren.")
         
         cf = {"id": st.column_config.NumberColumn(disabled=True), "date": st.column_config.DateColumn(format="DD.MM.YYYY"), "category": st.column_config.SelectboxColumn(options=current_categories + ["Back to Bank"]), "type": st.column_config.SelectboxColumn(options=["IST", "SOLL", "BANK_DEPOSIT"]), "amount": st.column_config.NumberColumn("€", format="%.2f"), "is_online": st.column_config.CheckboxColumn("Web")}
         er = st.data_editor(de, hide_index=True, use_container_width=True, column_config=cf, key="me", num_rows="dynamic")
@@ -817,21 +1312,35 @@ else:
         if st.session_state["me"]:
             ch = st.session_state["me"]
             for i in ch["deleted_rows"]: execute_db("DELETE FROM transactions WHERE id=?", (int(de.iloc[i]['id']),))
+            bad_edit = False
             for i, v in ch["edited_rows"].items():
                 rid = de.iloc[i]['id']
                 for k, val in v.items():
-                    if k == 'date' and isinstance(val, (datetime.date, datetime.datetime, pd.Timestamp)): val = val.strftime("%Y-%m-%d")
+                    if k in ('date', 'budget_month'):
+                        conv = to_db_date(val) if k == 'date' else to_db_month(val)
+                        if conv is None and val not in (None, ""):
+                            st.error(f"Ungültiger Wert '{val}' für {k} (ID {int(rid)}), bitte als {'TT.MM.JJJJ' if k == 'date' else 'JJJJ-MM'} eingeben.")
+                            bad_edit = True
+                            continue
+                        val = conv
                     if k=='is_online': val=1 if val else 0
                     execute_db(f"UPDATE transactions SET {k}=? WHERE id=?", (val, int(rid)))
             for r in ch["added_rows"]:
+                n_date, n_month = to_db_date(r.get('date') or date.today()), to_db_month(r.get('budget_month') or date.today())
+                if n_date is None or n_month is None:
+                    st.error(f"Neue Zeile nicht gespeichert: ungültiges Datum '{r.get('date')}' oder Budget-Monat '{r.get('budget_month')}'.")
+                    bad_edit = True
+                    continue
                 execute_db("INSERT INTO transactions (date, category, description, amount, type, budget_month, is_online) VALUES (?,?,?,?,?,?,?)",
-                           (r.get('date', date.today()), r.get('category', 'Sonstiges'), r.get('description', ''), r.get('amount', 0), r.get('type', 'IST'), r.get('budget_month', date.today().strftime('%Y-%m')), 1 if r.get('is_online') else 0))
-            if ch["deleted_rows"] or ch["edited_rows"] or ch["added_rows"]: st.rerun()
+                           (n_date, r.get('category', 'Sonstiges'), r.get('description', ''), r.get('amount', 0), r.get('type', 'IST'), n_month, 1 if r.get('is_online') else 0))
+            if ch["deleted_rows"] or ch["edited_rows"] or ch["added_rows"]:
+                execute_db(BAD_DATES_SQL)
+                if not bad_edit: st.rerun()
 
         st.divider()
         if st.checkbox("Gefahrenzone: Reset"):
             if st.button("Alles löschen", type="primary"):
-                execute_db("DELETE FROM transactions"); execute_db("DELETE FROM categories"); execute_db("DELETE FROM loans"); execute_db("DELETE FROM subscriptions"); execute_db("DELETE FROM sqlite_sequence"); execute_db("DELETE FROM denominations"); execute_db("DELETE FROM incomes")
+                execute_db("DELETE FROM balance_index"); execute_db("DELETE FROM transactions"); execute_db("DELETE FROM categories"); execute_db("DELETE FROM loans"); execute_db("DELETE FROM subscriptions"); execute_db("DELETE FROM sqlite_sequence"); execute_db("DELETE FROM denominations"); execute_db("DELETE FROM incomes"); execute_db("DELETE FROM tx_changes"); execute_db("DELETE FROM sync_state")
                 st.rerun()
 
     # T8 Anleitung
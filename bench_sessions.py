@@ -0,0 +1,157 @@
+"""Session-Benchmark für app.py auf Basis von streamlit.testing.v1.AppTest.
+
+Spielt realistische Abläufe (Dashboard öffnen, Monat wechseln, Ausgabe buchen,
+Verteiler buchen, Rohdaten ändern) gegen künstlich befüllte Datenbanken
+wachsender Größe durch und misst pro Rerun Laufzeit und Speicher-Peak
+(Peak-RSS des Session-Prozesses nach dem Schritt; bewusst kein tracemalloc,
+das verlangsamt die Reruns um ein Vielfaches). Mit --sessions laufen mehrere Sessions parallel
+in eigenen Prozessen – AppTest hält Runtime und Element-IDs prozessweit und
+ist nicht threadsicher; die gemeinsame SQLite-Datei bleibt der Engpass.
+
+    python bench_sessions.py --sizes 1000 10000 100000 --sessions 4 --rounds 3
+"""
+import argparse
+import functools
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+
+import numpy as np
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+CATEGORIES = ["Lebensmittel", "Miete", "Sparen", "Freizeit", "Transport", "Sonstiges", "Fixkosten", "Kleidung", "Geschenke", "Notgroschen"]
+SHOPS = ["Rewe", "Aldi", "Edeka", "Tankstelle", "Kino", "Drogerie", "Apotheke", "Baumarkt", "Bäcker", "Restaurant"]
+
+
+def new_app():
+    from streamlit.testing.v1 import AppTest
+    return AppTest.from_file(APP, default_timeout=600)
+
+
+def keep_main(fn):
+    # Der ScriptRunner hängt app.py als __main__ ein und setzt es nicht zurück -> danach findet
+    # pickle (spawn-Pool) run_session nicht mehr
+    @functools.wraps(fn)
+    def wrapper(*args):
+        main = sys.modules["__main__"]
+        try: return fn(*args)
+        finally: sys.modules["__main__"] = main
+    return wrapper
+
+
+@keep_main
+def seed_db(path, n_tx, seed=0):
+    # Schema legt die App selbst an (init_db), danach Massendaten chronologisch einfügen,
+    # damit die Saldo-Trigger nur am Ende des Index anhängen
+    os.environ["BUDGET_DB"] = path
+    new_app().run()
+    rng = random.Random(seed)
+    start = date.today() - timedelta(days=max(365, n_tx // 30))
+    span = (date.today() - start).days
+    rows = []
+    for i in range(n_tx):
+        d = start + timedelta(days=span * i // n_tx)
+        if d.day == 1 and rng.random() < 0.3:
+            rows.append((d.isoformat(), rng.choice(CATEGORIES), "Verteiler", rng.randint(50, 500), "SOLL", d.strftime("%Y-%m"), 0))
+        else:
+            rows.append((d.isoformat(), rng.choice(CATEGORIES), f"{rng.choice(SHOPS)} {rng.randint(1, 99)}", round(rng.uniform(2, 120), 2), "IST", d.strftime("%Y-%m"), int(rng.random() < 0.2)))
+    conn = sqlite3.connect(path)
+    conn.executemany("INSERT INTO transactions (date, category, description, amount, type, budget_month, is_online) VALUES (?,?,?,?,?,?,?)", rows)
+    conn.executemany("INSERT INTO subscriptions (name, amount, cycle, category, start_date) VALUES (?,?,?,?,?)",
+                     [("Streaming", 12.99, "Monatlich", "Abos/Software", "2023-01-15"), ("Versicherung", 240.0, "Jährlich", "Versicherungen", "2022-03-01")])
+    conn.execute("INSERT INTO loans (name, start_date, total_amount, interest_amount, term_months, monthly_payment) VALUES ('Auto', ?, 12000, 900, 48, 268.75)", ((date.today() - timedelta(days=400)).isoformat(),))
+    conn.execute("INSERT INTO incomes (name, amount, day_of_month) VALUES ('Gehalt', 3200, 28)")
+    conn.commit()
+    conn.close()
+
+
+def timed(samples, step, fn):
+    t = time.perf_counter()
+    at = fn()
+    samples.append((step, time.perf_counter() - t, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024))  # Linux: KiB
+    if at is not None and len(at.exception):
+        raise RuntimeError(f"{step}: {at.exception[0].message}")
+    return at
+
+
+@keep_main
+def run_session(path, rounds, seed):
+    os.environ["BUDGET_DB"] = path
+    rng = random.Random(seed)
+    samples, errors = [], []
+    try:
+        at = timed(samples, "Dashboard öffnen", lambda: new_app().run())
+        for _ in range(rounds):
+            months = [s for s in at.selectbox if s.label == "Zeitraum"]
+            if months and len(months[0].options) > 1:
+                timed(samples, "Monat wechseln", lambda: months[0].select_index(rng.randrange(len(months[0].options))).run())
+
+            next(n for n in at.number_input if n.label == "Betrag (€)").set_value(round(rng.uniform(1, 80), 2))
+            next(t for t in at.text_input if t.label == "Beschreibung / Notiz").input(f"{rng.choice(SHOPS)} Bench")
+            timed(samples, "Ausgabe buchen", lambda: next(b for b in at.button if b.label == "Speichern").click().run())
+
+            # st.data_editor lässt sich in AppTest nicht bedienen -> Editor-Inhalt über session_state vorgeben
+            bulk = at.session_state["bulk_df"].copy()
+            bulk["50er"] = 0
+            bulk.loc[bulk.index[:3], "50er"] = 1
+            bulk.loc[bulk.index[:3], "20er"] = 2
+            at.session_state["bulk_df"] = bulk
+            timed(samples, "Verteiler buchen", lambda: next(b for b in at.button if b.label == "Buchen").click().run())
+
+            # Rohdaten-Änderung: gleiche UPDATE-Anweisung wie der Editor, danach Rerun
+            conn = sqlite3.connect(path)
+            conn.execute("UPDATE transactions SET amount=? WHERE id=(SELECT id FROM transactions ORDER BY random() LIMIT 1)", (round(rng.uniform(1, 80), 2),))
+            conn.commit()
+            conn.close()
+            timed(samples, "Rohdaten ändern", lambda: at.run())
+    except Exception as e:
+        errors.append(repr(e))
+    return samples, errors
+
+
+def report(size, sessions, samples, wall, out):
+    lines = [f"\n== {size} Buchungen, {sessions} Session(s), {wall:.1f} s gesamt =="]
+    lines.append(f"{'Schritt':<18}{'n':>5}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}{'RSS MB':>10}")
+    for step in dict.fromkeys(s for s, _, _ in samples):
+        t = np.array([d for s, d, _ in samples if s == step]) * 1000
+        mem = max(m for s, _, m in samples if s == step) / 2**20
+        lines.append(f"{step:<18}{len(t):>5}{np.percentile(t, 50):>10.0f}{np.percentile(t, 95):>10.0f}{t.max():>10.0f}{mem:>10.1f}")
+    t = np.array([d for _, d, _ in samples]) * 1000
+    lines.append(f"{'Alle Reruns':<18}{len(t):>5}{np.percentile(t, 50):>10.0f}{np.percentile(t, 95):>10.0f}{t.max():>10.0f}")
+    print("\n".join(lines))
+    if out:
+        with open(out, "a") as f: f.write("\n".join(lines) + "\n")
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="Anzahl Buchungen je Test-DB")
+    p.add_argument("--sessions", type=int, default=1, help="parallele Sessions")
+    p.add_argument("--rounds", type=int, default=3, help="Durchläufe der Abläufe je Session")
+    p.add_argument("--out", help="Ergebnis zusätzlich an diese Datei anhängen")
+    args = p.parse_args()
+
+    # spawn statt fork: der Elternprozess hat Streamlit samt Threads schon geladen
+    with tempfile.TemporaryDirectory() as tmp, ProcessPoolExecutor(args.sessions, mp_context=multiprocessing.get_context("spawn")) as pool:
+        for size in args.sizes:
+            path = os.path.join(tmp, f"budget_{size}.db")
+            seed_db(path, size)
+            samples, errors = [], []
+            t = time.perf_counter()
+            for s, e in pool.map(run_session, [path] * args.sessions, [args.rounds] * args.sessions, range(args.sessions)):
+                samples += s
+                errors += e
+            report(size, args.sessions, samples, time.perf_counter() - t, args.out)
+            for e in errors: print(f"FEHLER: {e}", file=sys.stderr)
+            if errors: sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()